@@ -1,10 +1,10 @@
 
-from pydantic import BaseSettings
-class Settings(BaseSettings):
-    TELEGRAM_BOT_TOKEN: str = ''
-    DATABASE_URL: str = ''
-    REDIS_URL: str = ''
-    ADMIN_API_KEY: str = 'changeme'
-    class Config:
-        env_file = '.env'
+import os
+from dataclasses import dataclass
+@dataclass(frozen=True, slots=True)
+class Settings:
+    TELEGRAM_BOT_TOKEN: str = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    DATABASE_URL: str = os.environ.get('DATABASE_URL', '')
+    REDIS_URL: str = os.environ.get('REDIS_URL', '')
+    ADMIN_API_KEY: str = os.environ.get('ADMIN_API_KEY', 'changeme')
 settings = Settings()
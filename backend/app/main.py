@@ -1,14 +1,92 @@
 # backend/app/main.py
 import os
-import re
+import asyncio
+import hmac
 import logging
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Optional, Tuple
 import httpx
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+import msgspec
+import orjson
+from aiolimiter import AsyncLimiter
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import ORJSONResponse, Response
 
-logging.basicConfig(level=logging.INFO)
+# Unknown LOG_LEVEL values fall back to WARNING instead of failing at import
+_log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "WARNING").upper())
+logging.basicConfig(level=_log_level if isinstance(_log_level, int) else logging.WARNING)
 logger = logging.getLogger("telegram_bot")
 
-app = FastAPI()
+# Read configuration once at import; a missing token should fail startup, not each request
+BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
+ADMIN_KEY = os.environ.get("ADMIN_API_KEY", "")
+_ADMIN_KEY_B = ADMIN_KEY.encode()
+if not BOT_TOKEN:
+    raise RuntimeError("TELEGRAM_BOT_TOKEN not set")
+SEND_MESSAGE_PATH = f"/bot{BOT_TOKEN}/sendMessage"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Pre-serialized webhook ack shared by every request; Telegram ignores the body.
+# Only safe while no route or dependency uses BackgroundTasks, which FastAPI attaches to the returned Response.
+_OK_BODY = b'{"ok":true}'
+_OK_RESPONSE = Response(_OK_BODY, media_type="application/json")
+
+# Per-chat reply queue. The flusher starts at most one sender per chat; the sender drains
+# the queue in order and sends no more than once per CHAT_SEND_INTERVAL (Telegram: ~1 msg/s per chat)
+FLUSH_INTERVAL = 0.1
+CHAT_SEND_INTERVAL = 1.0
+MAX_BATCH_CHARS = 4000
+# Queued as (text, is_static); is_static marks one of the constant command replies
+_outbox: DefaultDict[int, List[Tuple[str, bool]]] = defaultdict(list)
+# Active sender task per chat; also keeps strong references so tasks are not garbage collected
+_senders: Dict[int, asyncio.Task] = {}
+
+# Telegram allows ~30 messages/s bot-wide; every sendMessage goes through this limiter
+_rate = AsyncLimiter(30, 1.0)
+MAX_SEND_ATTEMPTS = 3
+# Event-loop time before which no sendMessage goes out; pushed forward by any 429's retry_after
+_resume_at = 0.0
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.state.send_client = None  # httpx.AsyncClient for sendMessage, created on startup
+app.state.admin_client = None  # httpx.AsyncClient for slow/admin Bot API calls, created on startup
+app.state.flusher = None  # outbox flush loop task, created on startup
+
+
+# ---------- Lifecycle ----------
+@app.on_event("startup")
+async def startup():
+    # Separate pools so slow admin calls (setWebhook, getFile, ...) can't starve sendMessage.
+    # Both clients live for the whole process and reuse warm HTTP/2 connections.
+    app.state.send_client = httpx.AsyncClient(
+        base_url="https://api.telegram.org",
+        timeout=httpx.Timeout(connect=5.0, read=10.0, write=10.0, pool=1.0),
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=30.0),
+        http2=True,
+    )
+    app.state.admin_client = httpx.AsyncClient(
+        base_url="https://api.telegram.org",
+        timeout=httpx.Timeout(connect=5.0, read=60.0, write=60.0, pool=5.0),
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=30.0),
+        http2=True,
+    )
+    app.state.flusher = asyncio.create_task(_flush_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if app.state.flusher is not None:
+        app.state.flusher.cancel()
+        app.state.flusher = None
+    # Deliver whatever is still queued before the clients go away
+    _flush_outbox()
+    if _senders:
+        await asyncio.gather(*_senders.values(), return_exceptions=True)
+    for name in ("send_client", "admin_client"):
+        client = getattr(app.state, name)
+        if client is not None:
+            await client.aclose()
+            setattr(app.state, name, None)
 
 
 # ---------- Health ----------
@@ -18,23 +96,61 @@ async def health():
 
 
 # ---------- Utilities ----------
+_MD2_TABLE = str.maketrans({c: "\\" + c for c in r'_*[]()~`>#+-=|{}.!'})
+
+
 def escape_markdown_v2(text: str) -> str:
     """
     Escape characters according to Telegram MarkdownV2 rules.
     Characters to escape: _ * [ ] ( ) ~ ` > # + - = | { } . !
     """
-    if not isinstance(text, str):
-        return text
-    return re.sub(r'([_*\[\]\(\)~`>#+\-=|{}\.!])', r'\\\1', text)
+    return text.translate(_MD2_TABLE) if isinstance(text, str) else text
+
 
+def _retry_after(resp: httpx.Response) -> float:
+    """Read retry_after from a 429 body, defaulting to 1s when it's missing or not JSON."""
+    try:
+        return float(orjson.loads(resp.content)["parameters"]["retry_after"])
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        return 1.0
 
-async def send_message_async(token: str, chat_id: int, text: str, parse_mode: str = "MarkdownV2"):
+
+async def _post_message(client: httpx.AsyncClient, chat_id: int, body: bytes) -> httpx.Response:
+    """
+    POST sendMessage under the bot-wide rate limit.
+    On 429, pauses all sends for Telegram's retry_after and tries again, up to MAX_SEND_ATTEMPTS.
+    """
+    global _resume_at
+    loop = asyncio.get_running_loop()
+    for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+        # Honour a flood wait triggered by any chat's send, not just our own
+        while (delay := _resume_at - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        async with _rate:
+            resp = await client.post(SEND_MESSAGE_PATH, content=body, headers=JSON_HEADERS)
+        if resp.status_code != 429:
+            return resp
+        retry_after = _retry_after(resp)
+        _resume_at = max(_resume_at, loop.time() + retry_after)
+        if attempt == MAX_SEND_ATTEMPTS:
+            logger.warning("Still rate limited after %s attempts, dropping message to chat %s", attempt, chat_id)
+            return resp
+        logger.warning("Rate limited by Telegram, retrying in %ss", retry_after)
+    return resp
+
+
+async def send_message_async(chat_id: int, text: str, *, parse_mode: str = "MarkdownV2", pre_escaped: bool = False):
     """
     Send message via Telegram HTTP API.
     Tries with parse_mode (MarkdownV2) after escaping; on 400 will retry without parse_mode.
+    pre_escaped=True says text is one of the constant command replies, whose MarkdownV2 payload
+    was escaped and serialized at import; text without a prebuilt payload is escaped as usual.
     """
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    async with httpx.AsyncClient(timeout=15.0) as client:
+    client: httpx.AsyncClient = app.state.send_client
+    prefix = _STATIC_PAYLOAD_PREFIX.get(text) if pre_escaped and parse_mode == "MarkdownV2" else None
+    if prefix is not None:
+        body = prefix + b',"chat_id":%d}' % chat_id
+    else:
         # Prepare payload text depending on parse_mode
         payload_text = text
         if parse_mode == "MarkdownV2":
@@ -42,20 +158,79 @@ async def send_message_async(token: str, chat_id: int, text: str, parse_mode: st
         payload = {"chat_id": chat_id, "text": payload_text}
         if parse_mode:
             payload["parse_mode"] = parse_mode
+        body = orjson.dumps(payload)
+    try:
+        resp = await _post_message(client, chat_id, body)
+        logger.debug("sendMessage status: %s", resp.status_code)
+        # If Telegram returns 400 for entity parse errors, retry without parse_mode
+        if resp.status_code == 400 and parse_mode:
+            logger.warning("Markdown parse error, retrying without parse_mode")
+            fallback = {"chat_id": chat_id, "text": text}
+            resp2 = await _post_message(client, chat_id, orjson.dumps(fallback))
+            logger.debug("sendMessage fallback status: %s", resp2.status_code)
+            return resp2.json()
+        return resp.json()
+    except httpx.PoolTimeout:
+        # Pool is saturated: drop this reply rather than stalling the background worker
+        logger.warning("Connection pool exhausted, dropping message to chat %s", chat_id)
+        return None
+    except Exception as e:
+        logger.exception("Failed to sendMessage: %s", e)
+        return None
+
+
+# ---------- Outbox ----------
+def _batch_replies(replies: List[str]) -> List[str]:
+    """
+    Join queued replies with blank lines into messages of at most MAX_BATCH_CHARS.
+    A single reply longer than the limit is sent on its own.
+    """
+    batches = []
+    current = ""
+    for reply in replies:
+        if current and len(current) + 2 + len(reply) > MAX_BATCH_CHARS:
+            batches.append(current)
+            current = reply
+        else:
+            current = f"{current}\n\n{reply}" if current else reply
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _chat_sender(chat_id: int):
+    """
+    Drain one chat's outbox until it stays empty, pausing CHAT_SEND_INTERVAL after each send.
+    Replies queued while this runs are left in the outbox and picked up on the next pass.
+    """
+    while True:
+        replies = _outbox.pop(chat_id, None)
+        if not replies:
+            return
+        # A lone constant reply is sent as-is, so its prebuilt payload applies
+        pre_escaped = len(replies) == 1 and replies[0][1]
+        for text in _batch_replies([text for text, _ in replies]):
+            await send_message_async(chat_id, text, pre_escaped=pre_escaped)
+            await asyncio.sleep(CHAT_SEND_INTERVAL)
+
+
+def _flush_outbox():
+    """Start a sender for every chat with queued replies that doesn't already have one."""
+    for chat_id in list(_outbox):
+        if chat_id in _senders:
+            continue
+        task = asyncio.create_task(_chat_sender(chat_id))
+        _senders[chat_id] = task
+        task.add_done_callback(lambda _, chat_id=chat_id: _senders.pop(chat_id, None))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
         try:
-            resp = await client.post(url, json=payload)
-            logger.info("sendMessage status: %s %s", resp.status_code, resp.text)
-            # If Telegram returns 400 for entity parse errors, retry without parse_mode
-            if resp.status_code == 400 and parse_mode:
-                logger.warning("Markdown parse error, retrying without parse_mode")
-                fallback = {"chat_id": chat_id, "text": text}
-                resp2 = await client.post(url, json=fallback)
-                logger.info("sendMessage fallback status: %s %s", resp2.status_code, resp2.text)
-                return resp2.json()
-            return resp.json()
-        except Exception as e:
-            logger.exception("Failed to sendMessage: %s", e)
-            return None
+            _flush_outbox()
+        except Exception:
+            logger.exception("Outbox flush failed")
 
 
 def parse_command(text: str):
@@ -68,130 +243,192 @@ def parse_command(text: str):
     text = text.strip()
     if not text.startswith("/"):
         return (None, text)
-    parts = text.split(" ", 1)
-    cmd = parts[0].lower()
-    args = parts[1].strip() if len(parts) > 1 else ""
-    return (cmd, args)
+    head, _, tail = text.partition(" ")
+    return (head.lower(), tail.strip())
 
 
-# ---------- Webhook ----------
-@app.post("/webhook")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
-    token = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN not set in environment")
-        raise HTTPException(status_code=500, detail="Bot token not configured")
+# ---------- Commands ----------
+START_TEXT = (
+    "Hello! I'm alive and running. 🤖\n\n"
+    "Available commands:\n"
+    "/help - show help\n"
+    "/info - bot info\n"
+    "/echo <text> - echo back text\n"
+    "/setlang <zh|en> - set language\n"
+    "/about - about this bot\n\n"
+    "If you are an admin, use:\n"
+    "/broadcast <admin_key>|<message>  (admin only)"
+)
+HELP_TEXT = (
+    "*Help*\n"
+    "/start - start the bot\n"
+    "/help - this message\n"
+    "/info - info about bot\n"
+    "/echo <text> - bot will repeat your text\n"
+    "/setlang <zh|en> - set preferred language\n"
+    "/about - about this bot\n"
+)
+INFO_TEXT = "This bot is deployed on Render. It supports basic commands and admin broadcast."
+ABOUT_TEXT = "Telegram group management bot — basic demo. Extend me with features you need."
+ECHO_USAGE = "Usage: /echo <text>"
+SETLANG_ZH_TEXT = "语言已设置为中文 (zh)."
+SETLANG_EN_TEXT = "Language set to English (en)."
+SETLANG_USAGE = "Usage: /setlang <zh|en>"
+BROADCAST_USAGE = "Usage: /broadcast <admin_key>|<message>"
+BROADCAST_DENIED = "Invalid admin key. Access denied."
+
+# MarkdownV2 sendMessage payloads for the constant replies above, escaped and serialized once.
+# Each value is the JSON object minus its closing brace, ready for ',"chat_id":N}'.
+_STATIC_PAYLOAD_PREFIX: Dict[str, bytes] = {
+    text: orjson.dumps({"text": escape_markdown_v2(text), "parse_mode": "MarkdownV2"})[:-1]
+    for text in (
+        START_TEXT,
+        HELP_TEXT,
+        INFO_TEXT,
+        ABOUT_TEXT,
+        ECHO_USAGE,
+        SETLANG_ZH_TEXT,
+        SETLANG_EN_TEXT,
+        SETLANG_USAGE,
+        BROADCAST_USAGE,
+        BROADCAST_DENIED,
+    )
+}
 
-    admin_key = os.getenv("ADMIN_API_KEY", "")
 
+# Handlers return (reply_text, is_static); is_static is True only for the constants above
+Reply = Tuple[str, bool]
+
+
+def _cmd_start(args: str, admin_key: bytes) -> Reply:
+    return (START_TEXT, True)
+
+
+def _cmd_help(args: str, admin_key: bytes) -> Reply:
+    return (HELP_TEXT, True)
+
+
+def _cmd_info(args: str, admin_key: bytes) -> Reply:
+    return (INFO_TEXT, True)
+
+
+def _cmd_about(args: str, admin_key: bytes) -> Reply:
+    return (ABOUT_TEXT, True)
+
+
+def _cmd_echo(args: str, admin_key: bytes) -> Reply:
+    return (args, False) if args else (ECHO_USAGE, True)
+
+
+def _cmd_setlang(args: str, admin_key: bytes) -> Reply:
+    lang = args.lower()
+    if lang in ("zh", "cn", "zh-cn"):
+        return (SETLANG_ZH_TEXT, True)
+    if lang in ("en", "en-us"):
+        return (SETLANG_EN_TEXT, True)
+    return (SETLANG_USAGE, True)
+
+
+def _cmd_broadcast(args: str, admin_key: bytes) -> Reply:
+    # ADMIN COMMAND: expect args like "ADMINKEY|message to send"
+    if "|" not in args:
+        return (BROADCAST_USAGE, True)
+    provided_key, bmsg = args.split("|", 1)
+    provided_key = provided_key.strip()
+    bmsg = bmsg.strip()
+    if provided_key and hmac.compare_digest(provided_key.encode(), admin_key):
+        # Demo: reply to admin acknowledging broadcast
+        # Real implementation: fetch target chat IDs from DB and loop-send in background
+        return (f"Broadcast accepted. (Demo mode) Would send: {bmsg}", False)
+    return (BROADCAST_DENIED, True)
+
+
+COMMANDS: Dict[str, Callable[[str, bytes], Reply]] = {
+    "/start": _cmd_start,
+    "/help": _cmd_help,
+    "/info": _cmd_info,
+    "/echo": _cmd_echo,
+    "/setlang": _cmd_setlang,
+    "/about": _cmd_about,
+    "/broadcast": _cmd_broadcast,
+}
+
+
+# ---------- Update schema ----------
+# Only the fields the webhook reads; msgspec skips everything else while parsing.
+class Chat(msgspec.Struct):
+    id: int
+
+
+class Message(msgspec.Struct):
+    chat: Optional[Chat] = None
+    text: str = ""
+    caption: str = ""
+
+
+class CallbackQuery(msgspec.Struct):
+    data: str = ""
+    message: Optional[Message] = None
+
+
+class Update(msgspec.Struct):
+    message: Optional[Message] = None
+    edited_message: Optional[Message] = None
+    callback_query: Optional[CallbackQuery] = None
+
+
+_decode_update = msgspec.json.Decoder(Update).decode
+
+
+# ---------- Webhook ----------
+@app.post("/webhook")
+async def receive_webhook(request: Request):
     try:
-        update = await request.json()
-    except Exception:
+        update = _decode_update(await request.body())
+    except msgspec.ValidationError as e:
+        # Valid JSON that doesn't fit our schema: ack it, or Telegram will redeliver it forever
+        logger.warning("Skipping update that does not match schema: %s", e)
+        return _OK_RESPONSE
+    except msgspec.DecodeError:
         logger.exception("Invalid JSON in webhook")
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    logger.info("Received update: %s", update)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received update: %s", update)
 
     # locate message text and chat_id
     chat_id = None
     text = None
-    user_info = {}
-    if "message" in update:
-        msg = update["message"]
-        chat_id = msg.get("chat", {}).get("id")
-        text = msg.get("text") or msg.get("caption") or ""
-        user_info = {
-            "id": msg.get("from", {}).get("id"),
-            "username": msg.get("from", {}).get("username"),
-            "first_name": msg.get("from", {}).get("first_name"),
-        }
-    elif "edited_message" in update:
-        msg = update["edited_message"]
-        chat_id = msg.get("chat", {}).get("id")
-        text = msg.get("text") or ""
-    elif "callback_query" in update:
-        cq = update["callback_query"]
-        chat_id = cq.get("message", {}).get("chat", {}).get("id")
-        text = cq.get("data", "")
+    if update.message is not None:
+        msg = update.message
+        chat_id = msg.chat.id if msg.chat else None
+        text = msg.text or msg.caption
+    elif update.edited_message is not None:
+        msg = update.edited_message
+        chat_id = msg.chat.id if msg.chat else None
+        text = msg.text
+    elif update.callback_query is not None:
+        cq = update.callback_query
+        chat_id = cq.message.chat.id if cq.message and cq.message.chat else None
+        text = cq.data
 
     # if no chat_id, acknowledge
     if not chat_id:
-        return {"ok": True, "info": "no chat_id"}
+        return _OK_RESPONSE
 
     cmd, args = parse_command(text)
 
-    # default reply
-    reply_text = None
-
-    # COMMAND: /start
-    if cmd == "/start":
-        reply_text = (
-            "Hello! I'm alive and running. 🤖\n\n"
-            "Available commands:\n"
-            "/help - show help\n"
-            "/info - bot info\n"
-            "/echo <text> - echo back text\n"
-            "/setlang <zh|en> - set language\n"
-            "/about - about this bot\n\n"
-            "If you are an admin, use:\n"
-            "/broadcast <admin_key>|<message>  (admin only)"
-        )
-
-    # COMMAND: /help
-    elif cmd == "/help":
-        reply_text = (
-            "*Help*\n"
-            "/start - start the bot\n"
-            "/help - this message\n"
-            "/info - info about bot\n"
-            "/echo <text> - bot will repeat your text\n"
-            "/setlang <zh|en> - set preferred language\n"
-            "/about - about this bot\n"
-        )
-
-    # COMMAND: /info
-    elif cmd == "/info":
-        reply_text = "This bot is deployed on Render. It supports basic commands and admin broadcast."
-
-    # COMMAND: /echo
-    elif cmd == "/echo":
-        reply_text = args if args else "Usage: /echo <text>"
-
-    # COMMAND: /setlang
-    elif cmd == "/setlang":
-        if args.lower() in ("zh", "cn", "zh-cn"):
-            reply_text = "语言已设置为中文 (zh)."
-        elif args.lower() in ("en", "en-us"):
-            reply_text = "Language set to English (en)."
-        else:
-            reply_text = "Usage: /setlang <zh|en>"
-
-    # COMMAND: /about
-    elif cmd == "/about":
-        reply_text = "Telegram group management bot — basic demo. Extend me with features you need."
-
-    # ADMIN COMMAND: /broadcast <admin_key>|<message>
-    elif cmd == "/broadcast":
-        # expect args like "ADMINKEY|message to send"
-        if "|" not in args:
-            reply_text = "Usage: /broadcast <admin_key>|<message>"
-        else:
-            provided_key, bmsg = args.split("|", 1)
-            provided_key = provided_key.strip()
-            bmsg = bmsg.strip()
-            if provided_key and provided_key == admin_key:
-                # Demo: reply to admin acknowledging broadcast
-                reply_text = f"Broadcast accepted. (Demo mode) Would send: {bmsg}"
-                # Real implementation: fetch target chat IDs from DB and loop-send in background
-            else:
-                reply_text = "Invalid admin key. Access denied."
-
-    # fallback for non-command messages
+    handler = COMMANDS.get(cmd)
+    if handler:
+        reply_text, is_static = handler(args, _ADMIN_KEY_B)
+    elif not cmd:
+        # fallback for non-command messages
+        reply_text = f"已收到: {text}" if text else "Message received."
+        is_static = False
     else:
-        if not cmd:
-            reply_text = f"已收到: {text}" if text else "Message received."
+        reply_text = None
 
-    # send reply in background to keep webhook fast
+    # queue reply; the flusher coalesces per chat and sends outside the request
     if reply_text:
-        background_tasks.add_task(send_message_async, token, chat_id, reply_text)
-    return {"ok": True}
+        _outbox[chat_id].append((reply_text, is_static))
+    return _OK_RESPONSE
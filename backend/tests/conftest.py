@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app.main reads the token at import and refuses to load without one
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import httpx
+import orjson
+import pytest
+from aiolimiter import AsyncLimiter
+
+from app import main
+
+
+class FakeTelegram:
+    """Records sendMessage calls; responds with queued (status, body) pairs, then 200."""
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append((time.monotonic(), request.content))
+        if self.responses:
+            status, body = self.responses.pop(0)
+            return httpx.Response(status, content=body)
+        return httpx.Response(200, json={"ok": True, "result": {}})
+
+    @property
+    def texts(self):
+        return [orjson.loads(content)["text"] for _, content in self.calls]
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    fake = FakeTelegram()
+    monkeypatch.setattr(main, "CHAT_SEND_INTERVAL", 0.2)
+    monkeypatch.setattr(main, "_resume_at", 0.0)
+    # each test runs its own event loop; AsyncLimiter must not be shared across loops
+    monkeypatch.setattr(main, "_rate", AsyncLimiter(30, 1.0))
+    main._outbox.clear()
+    main._senders.clear()
+    main.app.state.flusher = None
+    main.app.state.admin_client = None
+    main.app.state.send_client = httpx.AsyncClient(
+        base_url="https://api.telegram.org", transport=httpx.MockTransport(fake)
+    )
+    yield fake
+    main._outbox.clear()
+    main._senders.clear()
+    main.app.state.send_client = None
+
+
+async def _drain():
+    main._flush_outbox()
+    while main._senders:
+        await asyncio.gather(*main._senders.values())
+
+
+def test_batch_replies_splits_at_max_chars(monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_CHARS", 10)
+    assert main._batch_replies(["aaaa", "bbbb", "cccc"]) == ["aaaa\n\nbbbb", "cccc"]
+    assert main._batch_replies(["x" * 25, "y"]) == ["x" * 25, "y"]
+
+
+def test_replies_to_one_chat_are_sent_in_order_and_paced(telegram):
+    async def scenario():
+        main._outbox[1].append(("first", False))
+        main._flush_outbox()
+        await asyncio.sleep(0.05)
+        # queued while the first sender is still pacing; must not start a second sender
+        main._outbox[1].append(("second", False))
+        main._flush_outbox()
+        assert len(main._senders) == 1
+        await _drain()
+
+    asyncio.run(scenario())
+    assert telegram.texts == ["first", "second"]
+    (t1, _), (t2, _) = telegram.calls
+    assert t2 - t1 >= main.CHAT_SEND_INTERVAL
+
+
+def test_outbox_batches_are_split_at_max_chars(telegram, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_CHARS", 10)
+    main._outbox[1].extend([("aaaa", False), ("bbbb", False), ("cccc", False)])
+    asyncio.run(_drain())
+    assert telegram.texts == ["aaaa\n\nbbbb", "cccc"]
+
+
+def test_shutdown_sends_queued_replies(telegram):
+    main._outbox[1].append(("pending", False))
+    main._outbox[2].append(("other", False))
+    asyncio.run(main.shutdown())
+    assert sorted(telegram.texts) == ["other", "pending"]
+    assert main.app.state.send_client is None
+
+
+def test_static_reply_uses_prebuilt_payload(telegram):
+    main._outbox[1].append(main._cmd_help("", b""))
+    asyncio.run(_drain())
+    (_, content), = telegram.calls
+    assert content == main._STATIC_PAYLOAD_PREFIX[main.HELP_TEXT] + b',"chat_id":1}'
+    assert orjson.loads(content)["text"] == main.escape_markdown_v2(main.HELP_TEXT)
+
+
+def test_echo_reply_is_escaped_per_send(telegram):
+    main._outbox[1].append(main._cmd_echo("hi.", b""))
+    asyncio.run(_drain())
+    assert telegram.texts == ["hi\\."]
+
+
+def test_pre_escaped_without_prebuilt_payload_falls_back_to_escaping(telegram):
+    result = asyncio.run(main.send_message_async(1, "hello!", pre_escaped=True))
+    assert result == {"ok": True, "result": {}}
+    assert telegram.texts == ["hello\\!"]
+
+
+def test_429_is_retried_after_retry_after(telegram):
+    telegram.responses = [(429, b'{"ok":false,"parameters":{"retry_after":0.1}}')]
+    result = asyncio.run(main.send_message_async(1, "hi"))
+    assert result == {"ok": True, "result": {}}
+    (t1, _), (t2, _) = telegram.calls
+    assert t2 - t1 >= 0.1
+
+
+def test_retry_after_defaults_when_body_is_not_json():
+    assert main._retry_after(httpx.Response(429, content=b"<html>Too Many Requests</html>")) == 1.0